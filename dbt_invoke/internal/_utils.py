@@ -1,10 +1,16 @@
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import functools
+import hashlib
+import io
 import json
 import logging
+import os
 from pathlib import Path
 import sys
-import platform
 import re
-from dbt.task.base import get_nearest_project_dir
+import threading
+import time
 
 try:
     from importlib.metadata import version
@@ -16,17 +22,55 @@ except ImportError:
 
     DBT_VERSION = pkg_resources.get_distribution('dbt-core').version
 
+from invoke.exceptions import UnexpectedExit
 from ruamel.yaml import YAML, YAMLError
 
+try:
+    import orjson
+
+    json_loads = orjson.loads
+
+except ImportError:
+    json_loads = json.loads
+
+# Fingerprints for the "dbt ls" cache only need to detect changes, not
+# resist tampering, so prefer a (much faster) non-cryptographic hash
+try:
+    from xxhash import xxh3_128 as _fingerprint_hash
+
+except ImportError:
+    _fingerprint_hash = hashlib.sha256
+
+_IS_WINDOWS = sys.platform.startswith('win')
+# Project info from get_project_info, keyed on the resolved directory it
+# was requested for, with values of
+# (dbt_project.yml path, its st_mtime_ns, project info)
+_PROJECT_INFO_CACHE = dict()
+# dbt-core's programmatic invocations share global state (flags,
+# adapters, event callbacks), so only one may run at a time
+_DBT_RUNNER_LOCK = threading.Lock()
+
 MACROS = {
     '_log_columns_list': (
         "\n{# This macro is intended for use by dbt-invoke #}"
-        "\n{% macro _log_columns_list(sql=none, resource_name=none) %}"
-        "\n    {% if sql is none %}"
-        "\n        {% set sql = 'select * from ' ~ ref(resource_name) %}"
-        "\n    {% endif %}"
-        "\n    {% if execute %}"
-        "\n        {{ log(get_columns_in_query(sql), info=True) }}"
+        "\n{% macro _log_columns_list("
+        "sql=none, resource_name=none, resource_names=none) %}"
+        "\n    {% if resource_names is not none %}"
+        "\n        {% if execute %}"
+        "\n            {% for name in resource_names %}"
+        "\n                {% set columns = get_columns_in_query("
+        "'select * from ' ~ ref(name)) %}"
+        "\n                {{ log(tojson({'name': name, 'columns': columns}),"
+        " info=True) }}"
+        "\n            {% endfor %}"
+        "\n        {% endif %}"
+        "\n    {% else %}"
+        "\n        {% if sql is none %}"
+        "\n            {% set sql = 'select * from ' ~ ref(resource_name) %}"
+        "\n        {% endif %}"
+        "\n        {% if execute %}"
+        "\n            {{ log(get_columns_in_query(sql), info=True) }}"
+        "\n        {% endif %}"
         "\n    {% endif %}"
         "\n{% endmacro %}\n"
     )
@@ -34,6 +78,33 @@ MACROS = {
 DBT_GLOBAL_ARGS = {
     'log-format': 'json',
 }
+# Substitutions to pass JSON through the Windows Command Prompt. An
+# escaped double quote is unescaped, other double quotes are escaped,
+# and redirection characters are escaped with a caret.
+_WINDOWS_ESCAPES = {'\\"': '"', '"': '\\"', '>': '^>', '<': '^<'}
+_WINDOWS_ESCAPE_REGEX = re.compile(r'\\"|["<>]')
+_ANSI_ESCAPE_REGEX = re.compile(r'(?:\x1B[@-_]|[\x80-\x9F])[0-?]*[ -/]*[@-~]')
+DBT_LS_CACHE_ENV_VAR = 'DBT_INVOKE_ENABLE_CACHE'
+# Overrides the per-user directory from _get_cache_dir, if set
+_DBT_LS_CACHE_DIR = None
+# Cache files that have not been written for this long are deleted, so
+# that the cache does not grow without bound
+_CACHE_MAX_AGE_SECONDS = 30 * 24 * 60 * 60
+# Cache directories already pruned by this process
+_PRUNED_CACHE_DIRS = set()
+# Project files that can affect the output of "dbt ls"
+_DBT_LS_CACHE_SUFFIXES = {'.sql', '.py', '.yml', '.yaml', '.csv', '.md'}
+# dbt_project.yml keys of the directories that dbt reads project files
+# from, with their dbt defaults
+_PROJECT_PATH_KEYS = {
+    'model-paths': ['models'],
+    'seed-paths': ['seeds'],
+    'snapshot-paths': ['snapshots'],
+    'analysis-paths': ['analyses'],
+    'macro-paths': ['macros'],
+    'test-paths': ['tests'],
+    'docs-paths': [],
+}
 DBT_LS_ARG_HELP = (
     'An argument for listing dbt resources (run "dbt ls --help" for details)'
 )
@@ -51,6 +122,9 @@ DBT_LS_ARGS = {
     'bypass_cache': {'help': DBT_LS_ARG_HELP, 'resource_selector': False},
     'state': {'help': DBT_LS_ARG_HELP, 'resource_selector': False},
 }
+_RESOURCE_SELECTOR_ARGS = tuple(
+    arg for arg, details in DBT_LS_ARGS.items() if details['resource_selector']
+)
 
 
 def get_logger(name, level='INFO'):
@@ -62,6 +136,20 @@ def get_logger(name, level='INFO'):
         (DEBUG, INFO, WARNING, ERROR, CRITICAL)
     :return: A logging.Logger object
     """
+    logger = _configure_logger(name)
+    logger.setLevel(level.upper())
+    return logger
+
+
+@functools.lru_cache(maxsize=None)
+def _configure_logger(name):
+    """
+    Attach dbt-invoke's handler and formatter to a logger, only once
+    per logger name
+
+    :param name: The name of the logger to configure
+    :return: A logging.Logger object
+    """
     logger = logging.getLogger(name)
     if logger.hasHandlers():
         logger.handlers.clear()
@@ -71,43 +159,91 @@ def get_logger(name, level='INFO'):
     )
     handler.setFormatter(formatter)
     logger.addHandler(handler)
-    logger.setLevel(level.upper())
     return logger
 
 
-def parse_yaml(location):
+def parse_yaml(location, round_trip=True):
     """
     Parse a yaml file
 
     :param location: The location of the yaml file to parse
+    :param round_trip: Whether to preserve formatting, quotes, and
+        comments so that the contents can be written back with
+        write_yaml. Read-only callers should set this to False to use
+        PyYAML's (much faster) safe loader instead.
     :return: The contents of the yaml file
     """
-    yaml = YAML(typ="rt")
-    yaml.preserve_quotes = True
+    # Imported here rather than at module level to keep CLI start up fast
+    import yaml
+
     with open(location, 'r') as stream:
-        try:
-            parsed_yaml = yaml.load(stream)
-            return parsed_yaml
-        except YAMLError as exc:
-            sys.exit(exc)
+        contents = stream.read()
+    try:
+        if not round_trip:
+            # Prefer the libyaml-backed loader when PyYAML was built
+            # against it
+            safe_loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+            return yaml.load(contents, Loader=safe_loader)
+        rt_yaml = YAML(typ="rt")
+        rt_yaml.preserve_quotes = True
+        return rt_yaml.load(contents)
+    except (YAMLError, yaml.YAMLError) as exc:
+        sys.exit(exc)
 
 
-def write_yaml(location, data, mode='w'):
+def write_yaml(
+    location, data, mode='w', round_trip=True, skip_unchanged=False
+):
     """
     Write a yaml file
 
     :param location: The location to which to write the yaml file
     :param data: The object which will be written to the yaml file
     :param mode: The mode in which to open the yaml file
-    :return: None
+    :param round_trip: Whether data may contain formatting, quotes, and
+        comments from parse_yaml that should be preserved. Callers
+        writing plain Python objects (e.g. for a new file) should set
+        this to False to use PyYAML's (much faster) safe dumper instead.
+    :param skip_unchanged: Whether to leave an existing file untouched
+        (keeping its modification time, which callers may update
+        themselves) if its contents would not change
+    :return: True if the file was written, else False
     """
-    yaml = YAML(typ="rt")
-    yaml.preserve_quotes = True
+    stream = io.StringIO()
     try:
-        with open(location, mode) as stream:
-            yaml.dump(data, stream)
+        if not round_trip:
+            # Imported here rather than at module level to keep CLI
+            # start up fast
+            import yaml
+
+            # Prefer the libyaml-backed dumper when PyYAML was built
+            # against it
+            safe_dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+            yaml.dump(
+                data,
+                stream,
+                Dumper=safe_dumper,
+                sort_keys=False,
+                allow_unicode=True,
+                default_flow_style=False,
+            )
+        else:
+            rt_yaml = YAML(typ="rt")
+            rt_yaml.preserve_quotes = True
+            rt_yaml.dump(data, stream)
     except YAMLError as exc:
         sys.exit(exc)
+    contents = stream.getvalue()
+    if skip_unchanged:
+        try:
+            with open(location, 'r') as existing_stream:
+                if existing_stream.read() == contents:
+                    return False
+        except FileNotFoundError:
+            pass
+    with open(location, mode) as f:
+        f.write(contents)
+    return True
 
 
 def get_project_info(ctx, project_dir=None):
@@ -119,28 +255,63 @@ def get_project_info(ctx, project_dir=None):
     :param project_dir: A directory containing a dbt_project.yml file
     :return: None
     """
+    # Reuse the project info from a previous call for the same directory
+    # as long as its dbt_project.yml has not been modified since
+    cache_key = str(Path(project_dir or os.getcwd()).resolve())
+    cached = _PROJECT_INFO_CACHE.get(cache_key)
+    if cached:
+        project_yml_path, project_yml_mtime, project_info = cached
+        try:
+            if os.stat(project_yml_path).st_mtime_ns == project_yml_mtime:
+                for key, value in project_info.items():
+                    ctx.config[key] = value
+                return
+        except OSError:
+            pass
+    # Importing dbt.task.base pulls in a large part of dbt-core, so defer
+    # it until it is needed
+    from dbt.task.base import get_nearest_project_dir
+
     project = Project(project_dir)
     project_path = get_nearest_project_dir(project.project_dir)
-    project_yml_path = Path(project_path, 'dbt_project.yml')
+    # Build the derived paths with the "/" operator from a single Path
+    project_root = Path(project_path)
+    project_yml_path = project_root / 'dbt_project.yml'
+    project_yml_mtime = os.stat(project_yml_path).st_mtime_ns
     # Get project configuration values from dbt_project.yml
     # (or use dbt defaults)
-    project_yml = parse_yaml(project_yml_path)
+    project_yml = parse_yaml(project_yml_path, round_trip=False)
     project_name = project_yml.get('name')
-    target_path = Path(project_path, project_yml.get('target-path', 'target'))
-    compiled_path = Path(target_path, 'compiled', project_name)
+    target_path = project_root / project_yml.get('target-path', 'target')
+    compiled_path = target_path / 'compiled' / project_name
     macro_paths = [
-        Path(project_path, macro_path)
+        project_root / macro_path
         for macro_path in project_yml.get('macro-paths', ['macros'])
     ]
+    resource_paths = [
+        project_root / resource_path
+        for key, default in _PROJECT_PATH_KEYS.items()
+        for resource_path in project_yml.get(key, default)
+    ]
+    project_info = {
+        'project_path': project_path,
+        'project_name': project_name,
+        'target_path': target_path,
+        'compiled_path': compiled_path,
+        'macro_paths': macro_paths,
+        'resource_paths': resource_paths,
+    }
+    _PROJECT_INFO_CACHE[cache_key] = (
+        project_yml_path,
+        project_yml_mtime,
+        project_info,
+    )
     # Set context config key-value pairs
-    ctx.config['project_path'] = project_path
-    ctx.config['project_name'] = project_name
-    ctx.config['target_path'] = target_path
-    ctx.config['compiled_path'] = compiled_path
-    ctx.config['macro_paths'] = macro_paths
+    for key, value in project_info.items():
+        ctx.config[key] = value
 
 
-def dbt_ls(
+def dbt_ls_iter(
     ctx,
     supported_resource_types=None,
     hide=True,
@@ -149,7 +320,8 @@ def dbt_ls(
     **kwargs,
 ):
     """
-    Run the "dbt ls" command with options
+    Run the "dbt ls" command with options, yielding each result as it
+    is parsed rather than collecting them all first
 
     :param ctx: An Invoke context object
     :param supported_resource_types: A list of supported resource types
@@ -161,65 +333,493 @@ def dbt_ls(
     :param logger: A logging.Logger object
     :param kwargs: Additional arguments for listing dbt resources
         (run "dbt ls --help" for details)
-    :return: A list of lines from stdout
+    :return: A generator of results from stdout
     """
     if not logger:
         logger = get_logger('')
-    resource_selection_arguments = {
-        arg: kwargs.get(arg)
-        for arg, details in DBT_LS_ARGS.items()
-        if details['resource_selector']
-    }
+    # Accumulate the command line arguments and join them only once
+    ls_arguments = list()
+    # The same arguments, as a list for running dbt in-process
+    ls_args = ['ls']
     # Use default arguments if no resource selection arguments are given
-    default_arguments = list()
-    if not any(resource_selection_arguments.values()):
-        default_arguments.append(f'--select {ctx.config["project_name"]}')
+    if not any(kwargs.get(arg) for arg in _RESOURCE_SELECTOR_ARGS):
+        ls_arguments.append(f'--select {ctx.config["project_name"]}')
+        ls_args.extend(('--select', ctx.config['project_name']))
     # Use all supported_resource_types unless a resource_type or models
     # kwarg is given
     if not kwargs.get('resource_type') and not kwargs.get('models'):
         if supported_resource_types:
             for rt in supported_resource_types:
-                default_arguments.append(f'{get_cli_kwargs(resource_type=rt)}')
-    default_arguments = ' '.join(default_arguments)
+                ls_arguments.append(f'--resource-type {rt}')
+                ls_args.extend(('--resource-type', rt))
     arguments = get_cli_kwargs(**kwargs)
-    dbt_command_cli_args = f'{default_arguments} {arguments} --output {output}'
-    dbt_global_cli_args = get_cli_kwargs(**DBT_GLOBAL_ARGS)
-    command = f"dbt {dbt_global_cli_args} ls {dbt_command_cli_args}"
-    logger.debug(f'Running command: {command}')
-    result = ctx.run(command, hide=hide)
-    result_stdout = escape_ansi(result.stdout)
-    result_lines = result_stdout.splitlines()
-    result_lines_filtered = list()
-    for line in result_lines:
-        # Because we set the dbt global arg "--log-format json", if
-        # line is valid json then it may be an actual result or it
-        # may be some other output from dbt, like a warning.
+    if arguments:
+        ls_arguments.append(arguments)
+        ls_args.extend(get_cli_args(**kwargs))
+    ls_arguments.extend(('--output', output))
+    ls_args.extend(('--output', output))
+    dbt_command_cli_args = ' '.join(ls_arguments)
+    command = ' '.join(
+        ('dbt', _DBT_GLOBAL_CLI_ARGS, 'ls', dbt_command_cli_args)
+    )
+    cache_path = None
+    if cache_enabled():
+        cache_key = _dbt_ls_cache_key(ctx, command, state=kwargs.get('state'))
+        cache_path = Path(_get_cache_dir(), f'{cache_key}.json')
         try:
-            line_dict = json.loads(line)
-        # If line is not valid json, then it should be an actual
-        # result. This is because even when the "dbt ls" command
-        # arg "--output" is not set to json, non-result logs will
-        # still be in json format (due to the dbt global arg
-        # "--log-format json").
-        except ValueError:
-            result_lines_filtered.append(line)
-            continue
-        data = line_dict.get("data")
-        if data and "msg" in data:
-            line_dict = json.loads(data["msg"])
-        else:
-            continue
-        # If 'resource_type' is in line_dict, then this is likely
-        # an actual result and not something else like a warning.
-        if 'resource_type' in line_dict:
-            result_lines_filtered.append(line_dict)
-        # Else, if 'resource_type' is not in line_dict, this may be
-        # a warning from dbt, so log it.
-        else:
-            logger.warning(f'Extra output from "dbt ls" command: {line}')
+            cached_results = json_loads(cache_path.read_bytes())
+        except (OSError, ValueError):
+            cached_results = None
+        if cached_results is not None:
+            logger.debug(f'Using cached results from {cache_path}')
+            yield from cached_results
+            return
+    # Results only need to be kept around if they will be cached
+    cached_results = list() if cache_path else None
+    dbt_runner = _get_dbt_runner_class()
+    if dbt_runner:
+        logger.debug(f'Running in-process: dbt ls {dbt_command_cli_args}')
+        with _DBT_RUNNER_LOCK:
+            result_lines = _invoke_dbt(
+                dbt_runner,
+                ls_args,
+                hide=hide,
+                logger=logger,
+            )
+        # Parse lazily, so each result is only parsed once its consumer
+        # asks for it
+        if output == 'json':
+            result_lines = map(json_loads, result_lines)
+    else:
+        logger.debug(f'Running command: {command}')
+        result_lines = _dbt_ls_subprocess(ctx, command, hide, logger)
+    for result_line in result_lines:
+        if cached_results is not None:
+            cached_results.append(result_line)
+        yield result_line
+    if cache_path:
+        _write_cache(cache_path, cached_results, logger=logger)
+
+
+def dbt_ls(
+    ctx,
+    supported_resource_types=None,
+    hide=True,
+    output='json',
+    logger=None,
+    **kwargs,
+):
+    """
+    Run the "dbt ls" command with options
+
+    :param ctx: An Invoke context object
+    :param supported_resource_types: A list of supported resource types
+        to default to if no resource selection arguments are given
+        (resource_type, select, models, exclude, selector)
+    :param hide: Whether to suppress command line logs
+    :param output: An argument for listing dbt resources
+        (run "dbt ls --help" for details)
+    :param logger: A logging.Logger object
+    :param kwargs: Additional arguments for listing dbt resources
+        (run "dbt ls --help" for details)
+    :return: A list of lines from stdout
+    """
+    return list(
+        dbt_ls_iter(
+            ctx,
+            supported_resource_types=supported_resource_types,
+            hide=hide,
+            output=output,
+            logger=logger,
+            **kwargs,
+        )
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _get_dbt_runner_class():
+    """
+    Get dbt-core's programmatic invocation class, if available
+
+    :return: dbt.cli.main.dbtRunner, or None for versions of dbt-core
+        that do not support programmatic invocations
+    """
+    try:
+        from dbt.cli.main import dbtRunner
+    except ImportError:
+        return None
+    return dbtRunner
+
+
+def _invoke_dbt(dbt_runner, args, hide=True, logger=None, events=None):
+    """
+    Run a dbt command in the current process, which avoids the cost of
+    starting a new Python interpreter and loading dbt-core for each
+    command. The caller must hold _DBT_RUNNER_LOCK.
+
+    :param dbt_runner: The dbt.cli.main.dbtRunner class
+    :param args: A list of command line arguments for dbt
+    :param hide: Whether to suppress command line logs
+    :param logger: A logging.Logger object
+    :param events: A list to which each event logged by dbt is
+        appended, in the same structure as dbt's json logs
+    :return: The result of the dbt command
+    """
+    if not logger:
+        logger = get_logger('')
+    error_messages = list()
+
+    def handle_event(event):
+        if events is not None:
+            events.append(
+                {
+                    'info': {
+                        'code': event.info.code,
+                        'level': event.info.level,
+                        'msg': event.info.msg,
+                    }
+                }
+            )
+        if event.info.level == 'warn':
+            logger.warning(
+                f'Extra output from "dbt {args[0]}" command: {event.info.msg}'
+            )
+        elif event.info.level == 'error':
+            error_messages.append(event.info.msg)
+
+    runner = dbt_runner(callbacks=[handle_event])
+    if hide:
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = runner.invoke(args)
+    else:
+        result = runner.invoke(args)
+    if not result.success:
+        if result.exception and not error_messages:
+            raise result.exception
+        # Match the errors reported by a dbt subprocess
+        message = '\n'.join(error_messages) or (
+            f'"dbt {" ".join(args)}" was not successful'
+        )
+        raise RuntimeError(message) from result.exception
+    return result.result
+
+
+def _dbt_ls_subprocess(ctx, command, hide, logger):
+    """
+    Run the "dbt ls" command in a subprocess and filter its output
+
+    :param ctx: An Invoke context object
+    :param command: The "dbt ls" command to run
+    :param hide: Whether to suppress command line logs
+    :param logger: A logging.Logger object
+    :return: A list of results from stdout
+    """
+    result_lines_filtered = list()
+
+    def collect_line(line):
+        result_line = _parse_dbt_ls_line(escape_ansi(line), logger)
+        if result_line is not None:
+            result_lines_filtered.append(result_line)
+
+    # Parse each line of stdout as soon as dbt emits it, rather than
+    # waiting for the command to finish
+    line_stream = _LineStream(
+        collect_line,
+        echo_stream=None if hide else sys.stdout,
+    )
+    try:
+        ctx.run(command, hide='err' if hide else None, out_stream=line_stream)
+    except UnexpectedExit as exc:
+        # Hidden output was only passed to line_stream, so have the
+        # error report it rather than claim that it was already printed
+        if hide and 'stdout' not in exc.result.hide:
+            exc.result.hide = ('stdout', *exc.result.hide)
+        raise
+    line_stream.close()
     return result_lines_filtered
 
 
+def _parse_dbt_ls_line(line, logger):
+    """
+    Extract the result, if any, from one line of "dbt ls" output
+
+    :param line: A line of stdout from the "dbt ls" command
+    :param logger: A logging.Logger object
+    :return: The result as a string or dictionary (depending on the
+        "dbt ls" output argument), or None if the line is not a result
+    """
+    # Because we set the dbt global arg "--log-format json", if
+    # line is valid json then it may be an actual result or it
+    # may be some other output from dbt, like a warning.
+    # Lines that cannot be a json object are results (see below), so
+    # skip the (comparatively costly) failed parse for them.
+    if not line.startswith('{'):
+        return line
+    try:
+        line_dict = json_loads(line)
+    # If line is not valid json, then it should be an actual
+    # result. This is because even when the "dbt ls" command
+    # arg "--output" is not set to json, non-result logs will
+    # still be in json format (due to the dbt global arg
+    # "--log-format json").
+    except ValueError:
+        return line
+    data = line_dict.get("data")
+    if data and "msg" in data:
+        line_dict = json_loads(data["msg"])
+    else:
+        return None
+    # If 'resource_type' is in line_dict, then this is likely
+    # an actual result and not something else like a warning.
+    if 'resource_type' in line_dict:
+        return line_dict
+    # Else, if 'resource_type' is not in line_dict, this may be
+    # a warning from dbt, so log it.
+    logger.warning(f'Extra output from "dbt ls" command: {line}')
+    return None
+
+
+def cache_enabled():
+    """
+    Check whether caching of "dbt ls" results and of resources' columns
+    has been enabled through the DBT_INVOKE_ENABLE_CACHE environment
+    variable
+
+    :return: True if caching is enabled, else False
+    """
+    return os.environ.get(DBT_LS_CACHE_ENV_VAR, '').lower() in (
+        '1',
+        'true',
+        'yes',
+    )
+
+
+def _get_cache_dir():
+    """
+    Get the directory in which cached results are stored. It is kept per
+    user, so that cached results are neither shared with nor blocked by
+    other users of the same machine. It is only resolved once caching
+    is used, since the home directory may not be resolvable.
+
+    :return: A Path object
+    """
+    if _DBT_LS_CACHE_DIR:
+        return _DBT_LS_CACHE_DIR
+    return Path(
+        os.environ.get('LOCALAPPDATA' if _IS_WINDOWS else 'XDG_CACHE_HOME')
+        or Path.home() / ('AppData/Local' if _IS_WINDOWS else '.cache'),
+        'dbt-invoke',
+    )
+
+
+def _dbt_ls_cache_key(ctx, command, state=None):
+    """
+    Fingerprint a "dbt ls" command along with the contents of the dbt
+    project files that may affect its results
+
+    :param ctx: An Invoke context object
+    :param command: The "dbt ls" command that will be run
+    :param state: The directory of the manifest given to the "dbt ls"
+        state argument, if any
+    :return: A hex digest to use as a cache key
+    """
+    project_path = Path(ctx.config['project_path'])
+    excluded_paths = {
+        Path(ctx.config['target_path']).resolve(),
+        Path(project_path, 'logs').resolve(),
+    }
+    # Only walk the directories that dbt reads the project from, along
+    # with the files at the top of the project (e.g. dbt_project.yml,
+    # packages.yml), rather than e.g. a virtual environment
+    file_paths = set(
+        _iter_project_files(project_path, excluded_paths, recursive=False)
+    )
+    for resource_path in ctx.config['resource_paths']:
+        file_paths.update(_iter_project_files(resource_path, excluded_paths))
+    file_paths = sorted(file_paths)
+    # Hashing is dominated by file reads, which release the GIL
+    max_workers = min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        file_digests = executor.map(_file_digest, file_paths)
+        fingerprint = _fingerprint_hash()
+        fingerprint.update(f'{DBT_VERSION}\n{command}\n'.encode())
+        for file_path, file_digest in zip(file_paths, file_digests):
+            relative_path = Path(os.path.relpath(file_path, project_path))
+            fingerprint.update(f'{relative_path.as_posix()}\n'.encode())
+            fingerprint.update(file_digest)
+    # State selectors (e.g. state:modified) compare the project against
+    # another manifest, which lives outside the project
+    if state:
+        try:
+            fingerprint.update(_file_digest(Path(state, 'manifest.json')))
+        except OSError:
+            pass
+    return fingerprint.hexdigest()
+
+
+def _file_digest(file_path):
+    """
+    Hash the contents of a file
+
+    :param file_path: The location of the file to hash
+    :return: The digest of the file's contents, as bytes
+    """
+    with open(file_path, 'rb') as f:
+        # hashlib.file_digest avoids reading the whole file into memory
+        # (Python 3.11+)
+        if hasattr(hashlib, 'file_digest'):
+            return hashlib.file_digest(f, _fingerprint_hash).digest()
+        return _fingerprint_hash(f.read()).digest()
+
+
+def _iter_project_files(directory, excluded_paths, recursive=True):
+    """
+    Find the files in a dbt project that may affect the results of
+    "dbt ls"
+
+    :param directory: The directory in which to search
+    :param excluded_paths: A set of resolved directory paths to skip
+    :param recursive: Whether to also search subdirectories. Symbolic
+        links to directories are not followed, so that a link loop
+        cannot recurse forever.
+    :return: A generator of Path objects
+    """
+    try:
+        entries = os.scandir(directory)
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                if (
+                    recursive
+                    and Path(entry.path).resolve() not in excluded_paths
+                ):
+                    yield from _iter_project_files(entry.path, excluded_paths)
+            elif Path(entry.name).suffix.lower() in _DBT_LS_CACHE_SUFFIXES:
+                yield Path(entry.path)
+
+
+def _write_cache(cache_path, data, logger=None):
+    """
+    Store json serializable data so that it may be reused. Failing to
+    do so only means that the data will not be reused.
+
+    :param cache_path: The location of the cache file
+    :param data: The data to store (e.g. the filtered results of
+        "dbt ls")
+    :param logger: A logging.Logger object
+    :return: None
+    """
+    if not logger:
+        logger = get_logger('')
+    # Write to a temporary file first so that concurrent readers never
+    # see a partially written cache file
+    temp_path = cache_path.with_suffix(f'.{os.getpid()}.tmp')
+    try:
+        cache_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        temp_path.write_text(json.dumps(data))
+        os.replace(temp_path, cache_path)
+    except OSError as exc:
+        logger.warning(f'Could not write to the cache at {cache_path}: {exc}')
+        with contextlib.suppress(OSError):
+            temp_path.unlink()
+        return
+    _prune_cache(cache_path.parent)
+
+
+def _prune_cache(cache_dir):
+    """
+    Delete the files in a cache directory that have not been written for
+    _CACHE_MAX_AGE_SECONDS, only once per directory per process. Failing
+    to delete a file only means that it is kept until a later run.
+
+    :param cache_dir: The cache directory to prune
+    :return: None
+    """
+    if cache_dir in _PRUNED_CACHE_DIRS:
+        return
+    _PRUNED_CACHE_DIRS.add(cache_dir)
+    expiry = time.time() - _CACHE_MAX_AGE_SECONDS
+    try:
+        with os.scandir(cache_dir) as entries:
+            expired_paths = [
+                entry.path
+                for entry in entries
+                if entry.is_file(follow_symlinks=False)
+                and entry.stat(follow_symlinks=False).st_mtime < expiry
+            ]
+    except OSError:
+        return
+    for expired_path in expired_paths:
+        with contextlib.suppress(OSError):
+            os.remove(expired_path)
+
+
+def columns_cache_key(ctx, resource_location, **kwargs):
+    """
+    Fingerprint a resource's compiled SQL along with the dbt arguments
+    used to collect its columns. Changes to upstream resources (e.g. for
+    "select *") or to the data warehouse itself are not detected.
+
+    :param ctx: An Invoke context object
+    :param resource_location: The location of the file representing the
+        resource, relative to the dbt project directory
+    :param kwargs: Arguments for _utils.dbt_run_operation (e.g. target)
+    :return: A hex digest to use as a cache key, or None if the resource
+        has not been compiled
+    """
+    compiled_path = Path(ctx.config['compiled_path'], resource_location)
+    try:
+        compiled_digest = _file_digest(compiled_path)
+    except OSError:
+        return None
+    fingerprint = _fingerprint_hash()
+    fingerprint.update(
+        f'{DBT_VERSION}\n{Path(resource_location).as_posix()}\n'
+        f'{get_cli_kwargs(**kwargs)}\n'.encode()
+    )
+    fingerprint.update(compiled_digest)
+    return fingerprint.hexdigest()
+
+
+def read_columns_cache(cache_key):
+    """
+    Get the cached columns of a resource
+
+    :param cache_key: A key from columns_cache_key
+    :return: A list of column names, or None if none were cached
+    """
+    try:
+        return json_loads(_columns_cache_path(cache_key).read_bytes())
+    except (OSError, ValueError):
+        return None
+
+
+def write_columns_cache(cache_key, columns, logger=None):
+    """
+    Cache the columns of a resource
+
+    :param cache_key: A key from columns_cache_key
+    :param columns: A list of column names
+    :param logger: A logging.Logger object
+    :return: None
+    """
+    _write_cache(_columns_cache_path(cache_key), columns, logger=logger)
+
+
+def _columns_cache_path(cache_key):
+    """
+    Get the location of a resource's cached columns
+
+    :param cache_key: A key from columns_cache_key
+    :return: A Path object
+    """
+    return Path(_get_cache_dir(), 'columns', f'{cache_key}.json')
+
+
 def get_cli_kwargs(**kwargs):
     """
     Transform Python keyword arguments to CLI keyword arguments
@@ -228,14 +828,39 @@ def get_cli_kwargs(**kwargs):
     :return: CLI keyword arguments
     """
     return ' '.join(
-        [
-            f'--{k.replace("_", "-")} {str(v).replace(",", " ")}'
-            for k, v in kwargs.items()
-            if v
-        ]
+        f'--{k.replace("_", "-")} {str(v).replace(",", " ")}'
+        for k, v in kwargs.items()
+        if v
     )
 
 
+def get_cli_args(**kwargs):
+    """
+    Transform Python keyword arguments to a list of CLI arguments, as a
+    shell would split the output of get_cli_kwargs. Values wrapped in
+    quotes (e.g. for --vars) are passed whole, without their quotes, on
+    every platform.
+
+    :param kwargs: Keyword arguments
+    :return: A list of CLI arguments
+    """
+    cli_args = list()
+    for k, v in kwargs.items():
+        if not v:
+            continue
+        cli_args.append(f'--{k.replace("_", "-")}')
+        value = str(v)
+        if len(value) > 1 and value[0] == value[-1] and value[0] in '\'"':
+            cli_args.append(value[1:-1])
+        else:
+            cli_args.extend(value.replace(',', ' ').split())
+    return cli_args
+
+
+# DBT_GLOBAL_ARGS never change, so only transform them once
+_DBT_GLOBAL_CLI_ARGS = get_cli_kwargs(**DBT_GLOBAL_ARGS)
+
+
 def dbt_run_operation(
     ctx,
     macro_name,
@@ -247,6 +872,9 @@ def dbt_run_operation(
     bypass_cache=None,
     hide=True,
     logger=None,
+    global_args=None,
+    parse_output=True,
+    event_code=None,
     **kwargs,
 ):
     """
@@ -269,8 +897,16 @@ def dbt_run_operation(
         (run "dbt run-operation --help" for details)
     :param hide: Whether to suppress command line logs
     :param logger: A logging.Logger object
+    :param global_args: dbt global arguments to use instead of
+        DBT_GLOBAL_ARGS (e.g. to skip json logs when the output is not
+        needed), when dbt runs in a subprocess
+    :param parse_output: Whether to parse each line of output as json
+    :param event_code: If given, only return the lines of output logged
+        with this dbt event code (e.g. "I062" for messages logged by the
+        macro), when parse_output is True
     :param kwargs: Arguments for defining macro's parameters
     :return: stdout in list where each item is one line of output
+        (parsed as json, unless parse_output is False)
     """
     if not logger:
         logger = get_logger('')
@@ -283,27 +919,82 @@ def dbt_run_operation(
         'bypass_cache': bypass_cache,
     }
     dbt_command_cli_args = get_cli_kwargs(**dbt_command_args)
-    dbt_global_cli_args = get_cli_kwargs(**DBT_GLOBAL_ARGS)
+    if global_args is None:
+        dbt_global_cli_args = _DBT_GLOBAL_CLI_ARGS
+    else:
+        dbt_global_cli_args = get_cli_kwargs(**global_args)
     macro_kwargs = json.dumps(kwargs, sort_keys=False)
-    if platform.system().lower().startswith('win'):
+    dbt_runner = _get_dbt_runner_class()
+    # Prefer running in-process, unless another thread already is, in
+    # which case a subprocess is used so that threads still run in
+    # parallel
+    if dbt_runner and _DBT_RUNNER_LOCK.acquire(blocking=False):
+        try:
+            args = [
+                'run-operation',
+                *get_cli_args(**dbt_command_args),
+                macro_name,
+                '--args',
+                macro_kwargs,
+            ]
+            logger.debug(f'Running in-process: dbt {" ".join(args)}')
+            result_lines = list()
+            _invoke_dbt(
+                dbt_runner,
+                args,
+                hide=hide,
+                logger=logger,
+                events=result_lines,
+            )
+        finally:
+            _DBT_RUNNER_LOCK.release()
+        if not parse_output:
+            return [line['info']['msg'] for line in result_lines]
+        if event_code:
+            return [
+                line
+                for line in result_lines
+                if line['info']['code'] == event_code
+            ]
+        return result_lines
+    if _IS_WINDOWS:
         # Format YAML string for Windows Command Prompt
-        macro_kwargs = macro_kwargs.replace('"', '\\"')
-        macro_kwargs = macro_kwargs.replace('\\\\"', '"')
-        macro_kwargs = macro_kwargs.replace('>', '^>')
-        macro_kwargs = macro_kwargs.replace('<', '^<')
+        macro_kwargs = _WINDOWS_ESCAPE_REGEX.sub(
+            lambda match: _WINDOWS_ESCAPES[match.group()], macro_kwargs
+        )
         macro_kwargs = f'"{macro_kwargs}"'
     else:
         # Format YAML string for Mac/Linux (bash)
-        macro_kwargs = macro_kwargs.replace("'", """'"'"'""")
+        if "'" in macro_kwargs:
+            macro_kwargs = macro_kwargs.replace("'", """'"'"'""")
         macro_kwargs = f"'{macro_kwargs}'"
-    command = (
-        f"dbt {dbt_global_cli_args} run-operation {dbt_command_cli_args}"
-        f" {macro_name} --args {macro_kwargs}"
+    command = ' '.join(
+        (
+            'dbt',
+            dbt_global_cli_args,
+            'run-operation',
+            dbt_command_cli_args,
+            macro_name,
+            '--args',
+            macro_kwargs,
+        )
     )
     logger.debug(f'Running command: {command}')
     result = ctx.run(command, hide=hide)
     result_stdout = escape_ansi(result.stdout)
-    result_lines = [json.loads(data) for data in result_stdout.splitlines()]
+    result_lines = result_stdout.splitlines()
+    if not parse_output:
+        return result_lines
+    if event_code:
+        # Skip parsing lines that cannot have been logged with the
+        # event code, which is most of them
+        result_lines = (data for data in result_lines if event_code in data)
+        return [
+            line_dict
+            for line_dict in map(json_loads, result_lines)
+            if line_dict['info'].get('code') == event_code
+        ]
+    result_lines = [json_loads(data) for data in result_lines]
     return result_lines
 
 
@@ -329,11 +1020,22 @@ def macro_exists(ctx, macro_name, logger=None, **kwargs):
     """
     if not logger:
         logger = get_logger('')
+    # The manifest is rewritten whenever dbt parses the project (e.g.
+    # during "dbt ls"), so trust it when it contains the macro. Otherwise
+    # it may be missing or stale, so confirm by running the macro.
+    if macro_name in _get_manifest_macros(ctx):
+        logger.debug(f'Found macro "{macro_name}" in the dbt manifest')
+        return True
     try:
         dbt_run_operation(
             ctx,
             macro_name,
             logger=logger,
+            # Only success or failure matters here, so spare dbt from
+            # formatting (and us from parsing) json logs. Errors are still
+            # included in the exception raised on failure.
+            global_args={'log-format': 'text'},
+            parse_output=False,
             sql=f'SELECT 1 AS __dbt_invoke_check_macro_{macro_name} LIMIT 0',
             **kwargs,
         )
@@ -350,6 +1052,59 @@ def macro_exists(ctx, macro_name, logger=None, **kwargs):
     return True
 
 
+def get_manifest_macro_sql(ctx, macro_name):
+    """
+    Get the SQL of a macro as found in the dbt project's manifest.json
+
+    :param ctx: An Invoke context object
+    :param macro_name: The name of the macro
+    :return: The macro's SQL, or None if the macro is not in the
+        manifest (or there is no manifest)
+    """
+    return _get_manifest_macros(ctx).get(macro_name)
+
+
+def _get_manifest_macros(ctx):
+    """
+    Get the macros in the dbt project's manifest.json
+
+    :param ctx: An Invoke context object
+    :return: A dictionary where the key is a macro name and the value is
+        the macro's SQL (empty if there is no manifest)
+    """
+    target_path = ctx.config.get('target_path')
+    if not target_path:
+        return dict()
+    manifest_path = Path(target_path, 'manifest.json')
+    try:
+        manifest_mtime_ns = manifest_path.stat().st_mtime_ns
+    except OSError:
+        return dict()
+    return _read_manifest_macros(manifest_path, manifest_mtime_ns)
+
+
+@functools.lru_cache(maxsize=1)
+def _read_manifest_macros(manifest_path, manifest_mtime_ns):
+    """
+    Read the macros from a manifest.json, which can be large, only once
+    for as long as it is unchanged
+
+    :param manifest_path: The location of the manifest.json
+    :param manifest_mtime_ns: The modification time of the manifest.json,
+        so that a changed manifest is read again
+    :return: A dictionary where the key is a macro name and the value is
+        the macro's SQL (empty if the manifest cannot be read)
+    """
+    try:
+        manifest = json_loads(manifest_path.read_bytes())
+    except (OSError, ValueError):
+        return dict()
+    return {
+        macro['name']: macro.get('macro_sql', '')
+        for macro in manifest.get('macros', {}).values()
+    }
+
+
 def add_macro(ctx, macro_name, logger=None):
     """
     Add a macro to a dbt project if the user confirms
@@ -391,14 +1146,15 @@ def add_macro(ctx, macro_name, logger=None):
         absolute_macro_paths = [
             mp.resolve() for mp in ctx.config['macro_paths']
         ]
+        absolute_macro_paths_set = frozenset(absolute_macro_paths)
+        location_parent = location.parent.resolve()
         while (
-            location.parent.resolve() not in absolute_macro_paths
+            location_parent not in absolute_macro_paths_set
             or location.suffix.lower() != '.sql'
         ):
-            if location.parent.resolve() not in absolute_macro_paths:
+            if location_parent not in absolute_macro_paths_set:
                 not_a_macro_path = (
-                    f'{location.parent.resolve()}'
-                    f' is not an existing macro path.'
+                    f'{location_parent} is not an existing macro path.'
                 )
                 existing_macro_paths_are = 'Your existing macro paths are:'
                 existing_macro_paths = "\n".join(
@@ -412,6 +1168,7 @@ def add_macro(ctx, macro_name, logger=None):
             if location.suffix.lower() != '.sql':
                 logger.warning('File suffix must be ".sql".')
             location = Path(input(alternate_prompt))
+            location_parent = location.parent.resolve()
     with location.open('a') as f:
         f.write(f'{get_macro(macro_name)}')
         logger.info(f'Macro "{macro_name}" added to {location.resolve()}')
@@ -421,8 +1178,60 @@ def escape_ansi(line):
     # Windows can sometime emit Control Sequences in command line outputs
     # (see https://docs.microsoft.com/en-us/windows/console/console-virtual-terminal-sequences)
     # The regex filters those out (see https://stackoverflow.com/a/14693789/15202709)
-    ansi_escape = re.compile(r'(?:\x1B[@-_]|[\x80-\x9F])[0-?]*[ -/]*[@-~]')
-    return ansi_escape.sub('', line)
+    return _ANSI_ESCAPE_REGEX.sub('', line)
+
+
+class _LineStream:
+    """
+    A file-like object, for use as an Invoke out_stream, that passes
+    each complete line of output to a callback as soon as it arrives
+    """
+
+    def __init__(self, callback, echo_stream=None):
+        """
+        Initialize a _LineStream object
+
+        :param callback: A function to call with each line of output
+            (without its line terminator)
+        :param echo_stream: An optional stream to which all output is
+            also written
+        """
+        self.callback = callback
+        self.echo_stream = echo_stream
+        self._partial_line = ''
+
+    def write(self, data):
+        """
+        Receive a chunk of output
+
+        :param data: A string containing zero or more lines of output
+        :return: None
+        """
+        if self.echo_stream:
+            self.echo_stream.write(data)
+        *lines, self._partial_line = f'{self._partial_line}{data}'.split('\n')
+        for line in lines:
+            self.callback(line.rstrip('\r'))
+
+    def flush(self):
+        """
+        Flush the echo stream, if any
+
+        :return: None
+        """
+        if self.echo_stream:
+            self.echo_stream.flush()
+
+    def close(self):
+        """
+        Pass any remaining output not terminated by a newline to the
+        callback
+
+        :return: None
+        """
+        if self._partial_line:
+            self.callback(self._partial_line.rstrip('\r'))
+            self._partial_line = ''
 
 
 class Project:
@@ -1,10 +1,12 @@
+import itertools
+import math
 import os
+import pydoc
 import traceback
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 import ast
 from collections import defaultdict
-import json
 
 from invoke import task
 
@@ -12,6 +14,8 @@ from dbt_invoke.internal import _utils
 
 _LOGGER = _utils.get_logger('dbt-invoke')
 _MACRO_NAME = '_log_columns_list'
+# dbt event code of the messages logged by the macro
+_MACRO_LOG_EVENT_CODE = 'I062'
 _SUPPORTED_RESOURCE_TYPES = {
     'model': 'models',
     'seed': 'seeds',
@@ -19,6 +23,11 @@ _SUPPORTED_RESOURCE_TYPES = {
     'analysis': 'analyses',
 }
 _PROGRESS_PADDING = 9  # Character padding to align progress logs
+# Default maximum number of resources whose columns are collected in a
+# single dbt run-operation
+_MAX_BATCH_SIZE = 100
+# Maximum number of file paths to list in a prompt before paging them
+_MAX_PROMPT_PATHS = 1000
 
 _update_and_delete_help = {
     arg.replace('_', '-'): details['help']
@@ -41,6 +50,17 @@ _update_and_delete_help['log-level'] = (
             " thread will run dbt's get_columns_in_query macro against the"
             " data warehouse."
         ),
+        'batch-size': (
+            "Maximum number of resources whose columns are collected in a"
+            " single dbt run-operation (default: 100). Use 1 to collect"
+            " columns one resource at a time."
+        ),
+        'only-changed': (
+            "Skip resources whose property file already lists columns and"
+            " was modified more recently than the resource's own file."
+            " Faster, but column changes that come from upstream resources"
+            " or from the data warehouse will be missed."
+        ),
     },
     auto_shortflags=False,
 )
@@ -60,6 +80,8 @@ def update(
     state=None,
     log_level=None,
     threads=1,
+    batch_size=_MAX_BATCH_SIZE,
+    only_changed=False,
 ):
     """
     Update property file(s) for the specified set of resources
@@ -96,6 +118,11 @@ def update(
         and in creating/updating the corresponding property files. Each
         thread will run dbt's get_columns_in_query macro against the
         data warehouse.
+    :param batch_size: Maximum number of resources whose columns are
+        collected in a single dbt run-operation
+    :param only_changed: Skip resources whose property file already
+        lists columns and was modified more recently than the resource's
+        own file
     :return: None
     """
     common_dbt_kwargs, transformed_ls_results = _initiate_alterations(
@@ -114,10 +141,16 @@ def update(
         state=state,
         log_level=log_level,
     )
+    if only_changed:
+        transformed_ls_results = _filter_changed_resources(
+            ctx, transformed_ls_results
+        )
     _create_all_property_files(
         ctx,
         transformed_ls_results,
         threads=threads,
+        batch_size=batch_size,
+        only_changed=only_changed,
         **common_dbt_kwargs,
     )
 
@@ -216,12 +249,8 @@ def _read_manifest(target_path):
     :return: dict representing a dbt manifest
         https://docs.getdbt.com/reference/artifacts/manifest-json
     """
-    with open(
-        Path(target_path, 'manifest').with_suffix('.json'),
-        "r",
-        encoding='utf-8',
-    ) as manifest_json:
-        return json.loads(manifest_json.read())
+    manifest_path = Path(target_path, 'manifest').with_suffix('.json')
+    return _utils.json_loads(manifest_path.read_bytes())
 
 
 @task(
@@ -325,6 +354,7 @@ def migrate(
     #     ...
     # }
     migration_map = defaultdict(list)
+    project_path = Path(ctx.config['project_path'])
     # Using the nodes from the manifest create a data structure that
     # keeps track of what existing yaml files we have and what
     # resources are defined in each.
@@ -334,19 +364,17 @@ def migrate(
         # node comes from the correct dbt project
         # (transformed_ls_results should already only contain nodes from
         # the correct dbt project).
-        if metadata['original_file_path'] not in transformed_ls_results:
+        resource_dict = transformed_ls_results.get(
+            metadata['original_file_path']
+        )
+        if resource_dict is None:
             continue
         # Skip if node is not present in any existing property file
-        elif not metadata.get('patch_path'):
+        patch_path = metadata.get('patch_path')
+        if not patch_path:
             continue
-        existing_property_path = Path(
-            ctx.config['project_path'],
-            metadata.get('patch_path').split('//')[-1],
-        )
-        resource_path = Path(
-            ctx.config['project_path'],
-            metadata['original_file_path'],
-        )
+        existing_property_path = project_path / patch_path.rpartition('//')[2]
+        resource_path = project_path / metadata['original_file_path']
         # Add data for to-be-created property files to the migration_map
         migration_map[existing_property_path].append(
             {
@@ -356,7 +384,7 @@ def migrate(
                     metadata['resource_type']
                 ),
                 'resource_path': resource_path,
-                'property_path': resource_path.with_suffix('.yml'),
+                'property_path': resource_dict['_property_path'],
             }
         )
     # Loop through the migration_map to perform the migration
@@ -371,8 +399,9 @@ def migrate(
         # Read each relevant property file once to keep things speedy
         existing_property_file_dict = _utils.parse_yaml(existing_property_path)
         # For each relevant resource type for this migration, collect
-        # the properties and index position of all resources within the
-        # existing property file
+        # the properties and index position of the resources to migrate
+        # within the existing property file
+        resource_names = {resource['name'] for resource in resource_list}
         existing_properties = {
             properties['name']: {
                 'resource_type_plural': k,
@@ -382,6 +411,7 @@ def migrate(
             for k, v in existing_property_file_dict.items()
             if k in relevant_resource_types_plural
             for i, properties in enumerate(v)
+            if properties['name'] in resource_names
         }
         # For each resource within the existing property path in the
         # migration_map copy the properties to their intended
@@ -507,23 +537,48 @@ def _transform_ls_results(ctx, **kwargs):
     :param kwargs: Arguments for listing dbt resources
         (run "dbt ls --help" for details)
     :return: Dictionary where the key is the resource path
-        and the value is dictionary form of the resource's json
+        and the value is a dictionary of the resource's name,
+        resource_type, and config (holding only materialized) from its
+        json, plus a '_property_path' key holding the Path of its
+        property file
     """
     # Run dbt ls to retrieve resource path and json information
     _LOGGER.info('Searching for matching resources...')
-    potential_results = _utils.dbt_ls(
+    # Filter the results as they are parsed, rather than holding the
+    # full list of resources in memory
+    potential_results = _utils.dbt_ls_iter(
         ctx,
         supported_resource_types=_SUPPORTED_RESOURCE_TYPES,
         logger=_LOGGER,
         output='json',
         **kwargs,
     )
-    potential_result_paths = None
+    # The json output already includes each resource's path and type,
+    # so a single "dbt ls" is enough to both select and locate resources
+    project_path = Path(ctx.config['project_path'])
+    # Resources tend to share directories, so list each directory once
+    # rather than checking every resource file on its own
+    directory_listings = dict()
     results = dict()
-    for i, potential_result in enumerate(potential_results):
+    for potential_result in potential_results:
+        if potential_result['resource_type'] not in _SUPPORTED_RESOURCE_TYPES:
+            continue
         potential_result_path = potential_result['original_file_path']
-        if Path(ctx.config['project_path'], potential_result_path).exists():
-            results[potential_result_path] = potential_result
+        resource_path = project_path / potential_result_path
+        if _file_exists(resource_path, directory_listings):
+            # Only keep what later steps use, rather than the whole json
+            # of each resource, and compute the property path once for
+            # all later consumers
+            results[potential_result_path] = {
+                'name': potential_result['name'],
+                'resource_type': potential_result['resource_type'],
+                'config': {
+                    'materialized': potential_result['config'].get(
+                        'materialized'
+                    ),
+                },
+                '_property_path': resource_path.with_suffix('.yml'),
+            }
     _LOGGER.info(
         f"Found {len(results)} matching resources in dbt project"
         f' "{ctx.config["project_name"]}"'
@@ -534,10 +589,81 @@ def _transform_ls_results(ctx, **kwargs):
     return results
 
 
+def _file_exists(file_path, directory_listings):
+    """
+    Check whether a file exists using a listing of its directory
+
+    :param file_path: A Path object
+    :param directory_listings: Dictionary where the key is a directory
+        Path and the value is a set of the names of its entries, filled
+        in as new directories are encountered
+    :return: True if the file exists, else False
+    """
+    directory_listing = directory_listings.get(file_path.parent)
+    if directory_listing is None:
+        try:
+            directory_listing = set(os.listdir(file_path.parent))
+        except OSError:
+            directory_listing = set()
+        directory_listings[file_path.parent] = directory_listing
+    return file_path.name in directory_listing
+
+
+def _filter_changed_resources(ctx, transformed_ls_results):
+    """
+    Filter out resources whose property file is already up to date with
+    the resource's own file
+
+    :param ctx: An Invoke context object
+    :param transformed_ls_results: Dictionary where the key is the
+        resource path and the value is the dictionary form of the
+        resource's json
+    :return: The subset of transformed_ls_results whose property files
+        may need to be created or updated
+    """
+    project_path = Path(ctx.config['project_path'])
+    results = dict()
+    for resource_location, resource_dict in transformed_ls_results.items():
+        property_path = resource_dict['_property_path']
+        try:
+            is_current = (
+                property_path.stat().st_mtime_ns
+                >= (project_path / resource_location).stat().st_mtime_ns
+            )
+        except FileNotFoundError:
+            is_current = False
+        if is_current:
+            # Only trust property files that already list columns
+            property_file_dict = _utils.parse_yaml(
+                property_path, round_trip=False
+            )
+            resource_type_plural = _SUPPORTED_RESOURCE_TYPES[
+                resource_dict['resource_type']
+            ]
+            try:
+                is_current = any(
+                    properties['name'] == resource_dict['name']
+                    and properties['columns']
+                    for properties in property_file_dict[resource_type_plural]
+                )
+            except (KeyError, TypeError):
+                is_current = False
+        if not is_current:
+            results[resource_location] = resource_dict
+    skipped = len(transformed_ls_results) - len(results)
+    _LOGGER.info(
+        f'Skipping {skipped} resources whose property files are newer than'
+        f' the resources themselves'
+    )
+    return results
+
+
 def _create_all_property_files(
     ctx,
     transformed_ls_results,
     threads=1,
+    batch_size=_MAX_BATCH_SIZE,
+    only_changed=False,
     **kwargs,
 ):
     """
@@ -552,6 +678,11 @@ def _create_all_property_files(
         and in creating/updating the corresponding property files. Each
         thread will run dbt's get_columns_in_query macro against the
         data warehouse.
+    :param batch_size: Maximum number of resources whose columns are
+        collected in a single dbt run-operation
+    :param only_changed: Whether the resources were selected by
+        comparing modification times, in which case unchanged property
+        files are marked as checked
     :param kwargs: Additional arguments for _utils.dbt_run_operation
         (run "dbt run-operation --help" for details)
     :return: None
@@ -559,61 +690,111 @@ def _create_all_property_files(
     # Run a check that will fail if the _MACRO_NAME macro does not exist
     if not _utils.macro_exists(ctx, _MACRO_NAME, logger=_LOGGER, **kwargs):
         _utils.add_macro(ctx, _MACRO_NAME, logger=_LOGGER)
-    # Handle the creation of property files in separate threads
+        macro_sql = None
+    else:
+        macro_sql = _utils.get_manifest_macro_sql(ctx, _MACRO_NAME)
+    # The macro added by earlier versions of dbt-invoke only collects the
+    # columns of one resource at a time, so every batched run-operation
+    # would fail before falling back to one run-operation per resource
+    if macro_sql is not None and 'resource_names' not in macro_sql:
+        _LOGGER.warning(
+            f'The "{_MACRO_NAME}" macro in this dbt project is from an'
+            f' earlier version of dbt-invoke, so columns will be collected'
+            f' one resource at a time. Replace it with the output of'
+            f' "dbt-invoke properties.echo-macro" to collect them in'
+            f' batches.'
+        )
+        batch_size = 1
+    # Group the resources into batches, each of which is handled by a
+    # single thread. Columns of resources that are materialized in the
+    # data warehouse are collected with one dbt run-operation per batch,
+    # while the others need their compiled SQL and are handled alone.
     transformed_ls_results_length = len(transformed_ls_results)
+    materialized_resources = list()
+    unmaterialized_resources = list()
+    for i, (k, v) in enumerate(transformed_ls_results.items()):
+        if _is_materialized(v):
+            materialized_resources.append((i + 1, k, v))
+        else:
+            unmaterialized_resources.append((i + 1, k, v))
+    # Spread the materialized resources evenly across threads, while
+    # capping the size of each batch so that no single thread is left
+    # with a long tail of work
+    batch_size = min(
+        max(int(batch_size), 1),
+        math.ceil(len(materialized_resources) / max(threads, 1)),
+    )
+    materialized_iterator = iter(materialized_resources)
+    batches = list()
+    while True:
+        batch = list(itertools.islice(materialized_iterator, batch_size))
+        if not batch:
+            break
+        batches.append(batch)
+    batches.extend([resource] for resource in unmaterialized_resources)
+    # Handle the creation of property files in separate threads
     with ThreadPoolExecutor(max_workers=threads) as executor:
         futures = {
             executor.submit(
-                _create_property_file,
+                _create_property_files,
                 ctx,
-                k,
-                v,
-                i + 1,
+                batch,
                 transformed_ls_results_length,
+                only_changed=only_changed,
                 **kwargs,
-            ): {'index': i + 1, 'resource_location': k}
-            for i, (k, v) in enumerate(transformed_ls_results.items())
+            ): batch
+            for batch in batches
         }
-        # Log success or failure for each thread
+        # Log success or failure for each resource
         successes = 0
         failures = 0
+        exception_messages = dict()
         for future in as_completed(futures):
-            index = futures[future]['index']
-            resource_location = futures[future]['resource_location']
-            progress = (
-                f'Resource {index} of {transformed_ls_results_length},'
-                f' {resource_location}'
-            )
-            if future.exception() is not None:
-                _LOGGER.error(f'{"[FAILURE]":>{_PROGRESS_PADDING}} {progress}')
-                failures += 1
-                # Store exception message for later when all tracebacks
-                # for failed futures will be logged
-                e = future.exception()
-                exception_lines = traceback.format_exception(
-                    type(e), e, e.__traceback__
+            # as_completed drops its references to each future once
+            # yielded, so dropping ours too lets each future's result
+            # (including any exceptions and their tracebacks) be freed
+            # once logged
+            batch = futures.pop(future)
+            try:
+                outcomes = future.result()
+            except (Exception, SystemExit) as e:
+                # The batch failed outside of the handling of any single
+                # resource, so count each of its resources as failed
+                outcomes = [
+                    (index, resource_location, e)
+                    for index, resource_location, _ in batch
+                ]
+            for index, resource_location, e in outcomes:
+                progress = (
+                    f'Resource {index} of {transformed_ls_results_length},'
+                    f' {resource_location}'
                 )
-                futures[future][
-                    'exception_message'
-                ] = f'{progress}\n{"".join(exception_lines)}'
-            else:
-                _LOGGER.info(f'{"[SUCCESS]":>{_PROGRESS_PADDING}} {progress}')
-                successes += 1
+                if e is not None:
+                    _LOGGER.error(
+                        f'{"[FAILURE]":>{_PROGRESS_PADDING}} {progress}'
+                    )
+                    failures += 1
+                    # Store exception message for later when all
+                    # tracebacks for failed resources will be logged
+                    exception_lines = traceback.format_exception(
+                        type(e), e, e.__traceback__
+                    )
+                    exception_messages[index] = (
+                        f'{progress}\n{"".join(exception_lines)}'
+                    )
+                else:
+                    _LOGGER.info(
+                        f'{"[SUCCESS]":>{_PROGRESS_PADDING}} {progress}'
+                    )
+                    successes += 1
     # Log traceback for all failures at the end
-    if failures:
-        exception_messages = list()
-        # Looping through futures instead of as_completed(futures) so
-        # that the failed futures are displayed in order of submission,
-        # rather than completion
-        for future in futures:
-            exception_message = futures[future].get('exception_message')
-            if exception_message:
-                exception_messages.append(exception_message)
-        if exception_messages:
-            exception_messages = '\n'.join(exception_messages)
-            _LOGGER.error(
-                f'Tracebacks for all failures:\n\n{exception_messages}'
-            )
+    if exception_messages:
+        # Sorting by index so that the failed resources are displayed
+        # in order of submission, rather than completion
+        exception_messages = '\n'.join(
+            exception_messages[index] for index in sorted(exception_messages)
+        )
+        _LOGGER.error(f'Tracebacks for all failures:\n\n{exception_messages}')
     # Log result summary
     _LOGGER.info(
         f'{"[DONE]":>{_PROGRESS_PADDING}}'
@@ -634,34 +815,38 @@ def _delete_all_property_files(ctx, transformed_ls_results):
         resource's json
     :return: None
     """
-    resource_paths = [
-        Path(ctx.config['project_path'], resource_location)
-        for resource_location in transformed_ls_results
-    ]
+    # Property files sit next to their resources, so list each directory
+    # once rather than checking every property file on its own
+    directory_listings = dict()
     property_paths = [
-        rp.with_suffix('.yml')
-        for rp in resource_paths
-        if rp.with_suffix('.yml').exists()
+        resource_dict['_property_path']
+        for resource_dict in transformed_ls_results.values()
+        if _file_exists(resource_dict['_property_path'], directory_listings)
     ]
     _LOGGER.info(
-        f'{len(property_paths)} of {len(resource_paths)}'
+        f'{len(property_paths)} of {len(transformed_ls_results)}'
         f' have existing property files'
     )
     # Delete the selected property paths
     if len(property_paths) > 0:
-        deletion_message_yml_paths = '\n'.join(
-            [str(property_path) for property_path in property_paths]
-        )
+        deletion_message_yml_paths = '\n'.join(map(str, property_paths))
         deletion_message_prefix = '\nThe following files will be deleted:\n\n'
         deletion_message_suffix = (
             f'\n\nAre you sure you want to delete these'
             f' {len(property_paths)} file(s) (answer: y/n)?\n'
         )
-        deletion_confirmation = input(
-            f'{deletion_message_prefix}'
-            f'{deletion_message_yml_paths}'
-            f'{deletion_message_suffix}'
-        )
+        # Page long lists of files rather than flooding the terminal
+        if len(property_paths) > _MAX_PROMPT_PATHS:
+            pydoc.pager(
+                f'{deletion_message_prefix}{deletion_message_yml_paths}'
+            )
+            deletion_confirmation = input(deletion_message_suffix)
+        else:
+            deletion_confirmation = input(
+                f'{deletion_message_prefix}'
+                f'{deletion_message_yml_paths}'
+                f'{deletion_message_suffix}'
+            )
         # User confirmation
         while deletion_confirmation.lower() not in ['y', 'n']:
             deletion_confirmation = input(
@@ -669,8 +854,11 @@ def _delete_all_property_files(ctx, transformed_ls_results):
                 ' or "n" to abort deletion.\n'
             )
         if deletion_confirmation.lower() == 'y':
-            for file in property_paths:
-                os.remove(file)
+            # Overlap the deletions, which matters on network filesystems
+            with ThreadPoolExecutor(
+                max_workers=min(32, len(property_paths))
+            ) as executor:
+                list(executor.map(_remove_file, property_paths))
             _LOGGER.info('Deletion confirmed.')
         else:
             _LOGGER.info('Deletion aborted.')
@@ -678,47 +866,214 @@ def _delete_all_property_files(ctx, transformed_ls_results):
         _LOGGER.info('There are no files to delete.')
 
 
-def _create_property_file(
-    ctx,
-    resource_location,
-    resource_dict,
-    counter,
-    total,
-    **kwargs,
-):
+def _remove_file(file_path):
     """
-    Create a property file
+    Delete a file, unless it has already been deleted (e.g. by another
+    process since the user confirmed its deletion)
+
+    :param file_path: A Path object
+    :return: None
+    """
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+
+
+def _create_property_files(ctx, batch, total, only_changed=False, **kwargs):
+    """
+    Create property files for a batch of resources
 
     :param ctx: An Invoke context object
-    :param resource_location: The location of the file representing the
-        resource
-    :param resource_dict: A dictionary representing the json output for
-        this resource from the "dbt ls" command
-    :param counter: An integer assigned to this file (for logging the
-        progress of file creation)
+    :param batch: A list of 3-tuples of:
+        1. An integer assigned to the resource (for logging the progress
+        of file creation)
+        2. The location of the file representing the resource
+        3. A dictionary representing the json output for the resource
+        from the "dbt ls" command
     :param total: An integer representing the total number of files to
         be created (for logging the progress of file creation)
+    :param only_changed: Whether to mark unchanged property files as
+        checked (see _create_property_file)
     :param kwargs: Additional arguments for _utils.dbt_run_operation
         (run "dbt run-operation --help" for details)
-    :return: None
+    :return: A list of 3-tuples of each resource's integer, location,
+        and the exception raised in creating its property file (or None
+        upon success)
     """
-    _LOGGER.info(
-        f'{"[START]":>{_PROGRESS_PADDING}}'
-        f' Resource {counter} of {total},'
-        f' {resource_location}'
+    for counter, resource_location, _ in batch:
+        _LOGGER.info(
+            f'{"[START]":>{_PROGRESS_PADDING}}'
+            f' Resource {counter} of {total},'
+            f' {resource_location}'
+        )
+    cache_keys = dict()
+    cached_columns = dict()
+    if _utils.cache_enabled():
+        for _, resource_location, resource_dict in batch:
+            cache_key = _utils.columns_cache_key(
+                ctx, resource_location, **kwargs
+            )
+            if not cache_key:
+                continue
+            columns = _utils.read_columns_cache(cache_key)
+            if columns is None:
+                cache_keys[resource_dict['name']] = cache_key
+            else:
+                cached_columns[resource_dict['name']] = columns
+    batch_columns = _get_batch_columns(
+        ctx,
+        [item for item in batch if item[2]['name'] not in cached_columns],
+        **kwargs,
     )
-    columns = _get_columns(ctx, resource_location, resource_dict, **kwargs)
-    property_path = Path(
-        ctx.config['project_path'], resource_location
-    ).with_suffix('.yml')
+    outcomes = list()
+    for counter, resource_location, resource_dict in batch:
+        resource_name = resource_dict['name']
+        try:
+            columns = cached_columns.get(resource_name)
+            if columns is None:
+                columns = batch_columns.get(resource_name)
+            # Fall back to collecting the columns of this resource alone
+            if columns is None:
+                columns = _get_columns(
+                    ctx, resource_location, resource_dict, **kwargs
+                )
+            if resource_name in cache_keys and columns is not None:
+                _utils.write_columns_cache(
+                    cache_keys[resource_name], columns, logger=_LOGGER
+                )
+            _create_property_file(
+                resource_dict, columns, only_changed=only_changed
+            )
+        # _utils.parse_yaml exits on malformed yaml, which should only
+        # fail this resource rather than the whole batch
+        except (Exception, SystemExit) as e:
+            outcomes.append((counter, resource_location, e))
+        else:
+            outcomes.append((counter, resource_location, None))
+    return outcomes
+
+
+def _create_property_file(resource_dict, columns, only_changed=False):
+    """
+    Create a property file
+
+    :param resource_dict: A dictionary representing the json output for
+        this resource from the "dbt ls" command (as transformed by
+        _transform_ls_results)
+    :param columns: A list of the column names in the resource
+    :param only_changed: Whether to update the modification time of an
+        unchanged property file, so that later runs with only_changed
+        skip its resource
+    :return: None
+    """
+    property_path = resource_dict['_property_path']
+    # New property files have no formatting or comments to preserve, so
+    # they can be written with the faster, non-round-trip dumper
+    is_new = not property_path.exists()
     property_file_dict = _structure_property_file_dict(
         property_path,
         resource_dict,
         columns,
     )
-    _utils.write_yaml(
+    # Leave existing files untouched if their contents would not change,
+    # which also spares dbt from re-parsing them (unless only_changed
+    # marks them as checked below)
+    is_written = _utils.write_yaml(
         property_path,
         property_file_dict,
+        round_trip=not is_new,
+        skip_unchanged=True,
+    )
+    if not is_written:
+        _LOGGER.debug(f'No changes to {property_path}')
+        if only_changed:
+            # Mark the property file as checked against the resource.
+            # Failing to do so only means that it will be checked again.
+            try:
+                os.utime(property_path)
+            except OSError as exc:
+                _LOGGER.debug(
+                    f'Could not mark {property_path} as checked: {exc}'
+                )
+
+
+def _is_materialized(resource_dict):
+    """
+    Check whether a resource is materialized in the data warehouse
+
+    :param resource_dict: A dictionary representing the json output for
+        this resource from the "dbt ls" command
+    :return: True if the resource is materialized, else False
+    """
+    return (
+        resource_dict['config']['materialized'] != 'ephemeral'
+        and resource_dict['resource_type'] != 'analysis'
+    )
+
+
+def _get_batch_columns(ctx, batch, **kwargs):
+    """
+    Get the column names of each resource in a batch that is
+    materialized in the data warehouse, using a single dbt run-operation
+
+    :param ctx: An Invoke context object
+    :param batch: A list of 3-tuples as for _create_property_files
+    :param kwargs: Additional arguments for _utils.dbt_run_operation
+        (run "dbt run-operation --help" for details)
+    :return: A dictionary where the key is the resource name and the
+        value is a list of the column names in the resource (empty if
+        the batch could not be handled in a single run-operation)
+    """
+    resource_names = [
+        resource_dict['name']
+        for _, _, resource_dict in batch
+        if _is_materialized(resource_dict)
+    ]
+    if len(resource_names) < 2:
+        return dict()
+    try:
+        result_lines = _utils.dbt_run_operation(
+            ctx,
+            _MACRO_NAME,
+            hide=True,
+            logger=_LOGGER,
+            event_code=_MACRO_LOG_EVENT_CODE,
+            resource_names=resource_names,
+            **kwargs,
+        )
+    # This also happens when the project contains an older version of
+    # the macro, or when any one resource in the batch fails
+    except Exception:
+        _LOGGER.warning(
+            f'Could not collect the columns of {len(resource_names)}'
+            f' resources in a single run-operation,'
+            f' collecting them one at a time instead'
+        )
+        return dict()
+    batch_columns = dict()
+    for message in _get_logged_messages(result_lines):
+        try:
+            logged = _utils.json_loads(message)
+        except (TypeError, ValueError):
+            continue
+        if isinstance(logged, dict) and 'name' in logged:
+            batch_columns[logged['name']] = logged.get('columns')
+    return batch_columns
+
+
+def _get_logged_messages(result_lines):
+    """
+    Get the messages logged by the macro in a dbt run-operation
+
+    :param result_lines: An iterable of the parsed lines of output from
+        _utils.dbt_run_operation
+    :return: A generator of the logged messages
+    """
+    return (
+        line.get('msg', line.get('info', dict()).get('msg'))
+        for line in result_lines
+        if line["info"].get("code") == _MACRO_LOG_EVENT_CODE
     )
 
 
@@ -736,15 +1091,14 @@ def _get_columns(ctx, resource_location, resource_dict, **kwargs):
     :return: A list of the column names in the resource
     """
     resource_path = Path(resource_location)
-    materialized = resource_dict['config']['materialized']
-    resource_type = resource_dict['resource_type']
     resource_name = resource_dict['name']
-    if materialized != 'ephemeral' and resource_type != 'analysis':
+    if _is_materialized(resource_dict):
         result_lines = _utils.dbt_run_operation(
             ctx,
             _MACRO_NAME,
             hide=True,
             logger=_LOGGER,
+            event_code=_MACRO_LOG_EVENT_CODE,
             resource_name=resource_name,
             **kwargs,
         )
@@ -753,37 +1107,42 @@ def _get_columns(ctx, resource_location, resource_dict, **kwargs):
     # are used instead
     else:
         resource_path = Path(ctx.config['compiled_path'], resource_path)
-        with open(resource_path, 'r') as f:
-            lines = f.readlines()
         # Get and clean the SQL code
-        lines = [line.strip() for line in lines if line.strip()]
-        sql = "\n".join(lines)
+        lines = resource_path.read_text().splitlines()
+        lines = (line.strip() for line in lines)
+        sql = "\n".join(line for line in lines if line)
         result_lines = _utils.dbt_run_operation(
-            ctx, _MACRO_NAME, hide=True, logger=_LOGGER, sql=sql, **kwargs
+            ctx,
+            _MACRO_NAME,
+            hide=True,
+            logger=_LOGGER,
+            event_code=_MACRO_LOG_EVENT_CODE,
+            sql=sql,
+            **kwargs,
         )
 
-    relevant_lines = list(
-        filter(
-            lambda x: x["info"].get("code") == "I062",
-            result_lines,
-        )
+    # The columns are in the last message logged by the macro, so search
+    # from the end and stop at the first match
+    columns = next(_get_logged_messages(reversed(result_lines)), None)
+    # In some version of dbt columns are not passed as valid json but as
+    # a string representation of a list
+    is_string_list = (
+        isinstance(columns, str)
+        and columns.startswith('[')
+        and columns.endswith(']')
     )
-    if len(relevant_lines) >= 1:
-        relevant_line = relevant_lines[-1]
-        columns = relevant_line.get(
-            'msg',
-            relevant_line.get('info', dict()).get('msg'),
-        )
-        # In some version of dbt columns are not passed as valid json but as
-        # a string representation of a list
-        is_string_list = (
-            isinstance(columns, str)
-            and columns.startswith('[')
-            and columns.endswith(']')
-        )
-        if is_string_list:
+    if is_string_list:
+        # Such strings can usually be parsed as json, which is much
+        # faster than parsing a Python literal. Quotes are only swapped
+        # when no column name can contain a quote or an escape.
+        json_columns = columns
+        if '"' not in columns and '\\' not in columns:
+            json_columns = columns.replace("'", '"')
+        try:
+            columns = _utils.json_loads(json_columns)
+        except ValueError:
             columns = ast.literal_eval(columns)
-        return columns
+    return columns
 
 
 def _structure_property_file_dict(location, resource_dict, columns_list):
@@ -811,23 +1170,25 @@ def _structure_property_file_dict(location, resource_dict, columns_list):
     # will be used to create a new property file.
     else:
         property_file_dict = _get_property_header(resource_name, resource_type)
-    # Get the sub-dictionaries of each existing column
     resource_type_plural = _SUPPORTED_RESOURCE_TYPES[resource_type]
-    existing_columns_dict = {
-        item['name']: item
-        for item in property_file_dict[resource_type_plural][0]['columns']
-    }
+    properties = property_file_dict[resource_type_plural][0]
+    existing_columns = properties['columns']
+    # Keep the existing columns as they are if they already match
+    if [item['name'] for item in existing_columns] == list(columns_list):
+        return property_file_dict
+    # Get the sub-dictionaries of each existing column
+    existing_columns_dict = {item['name']: item for item in existing_columns}
     # For each column we want in the property file,
     # reuse the sub-dictionary if it exists
     # or else create a new sub-dictionary
-    property_file_dict[resource_type_plural][0]['columns'] = list()
-    for column in columns_list:
-        column_dict = existing_columns_dict.get(
-            column, _get_property_column(column)
-        )
-        property_file_dict[resource_type_plural][0]['columns'].append(
-            column_dict
+    properties['columns'] = [
+        (
+            existing_columns_dict[column]
+            if column in existing_columns_dict
+            else _get_property_column(column)
         )
+        for column in columns_list
+    ]
     return property_file_dict
 
 
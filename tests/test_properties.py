@@ -1,3 +1,5 @@
+import os
+import tempfile
 import unittest
 from pathlib import Path
 from unittest.mock import patch
@@ -149,6 +151,158 @@ class TestProperties(TestDbtInvoke):
             except FileNotFoundError:
                 continue
 
+    def test_update_only_changed(self):
+        """
+        Test that resources with up to date property files are skipped
+        when updating with only_changed
+
+        :return: None
+        """
+        with patch('builtins.input', return_value='y'):
+            properties.update(
+                self.ctx,
+                project_dir=self.project_dir,
+                profiles_dir=self.profiles_dir,
+            )
+        with patch.object(
+            properties,
+            '_create_property_files',
+            wraps=properties._create_property_files,
+        ) as create_property_files:
+            properties.update(
+                self.ctx,
+                project_dir=self.project_dir,
+                profiles_dir=self.profiles_dir,
+                only_changed=True,
+            )
+        create_property_files.assert_not_called()
+        # Unchanged property files are left untouched without only_changed
+        property_path = Path(
+            self.project_dir, 'models', 'marts', 'core', 'customers.yml'
+        )
+        property_mtime = property_path.stat().st_mtime_ns
+        properties.update(
+            self.ctx,
+            project_dir=self.project_dir,
+            profiles_dir=self.profiles_dir,
+        )
+        self.assertEqual(property_path.stat().st_mtime_ns, property_mtime)
+        # A resource edited without any change to its columns is still
+        # skipped once its (unchanged) property file has been checked
+        resource_path = Path(
+            self.project_dir, 'models', 'marts', 'core', 'customers.sql'
+        )
+        os.utime(resource_path)
+        properties.update(
+            self.ctx,
+            project_dir=self.project_dir,
+            profiles_dir=self.profiles_dir,
+            only_changed=True,
+        )
+        with patch.object(
+            properties,
+            '_create_property_files',
+            wraps=properties._create_property_files,
+        ) as create_property_files:
+            properties.update(
+                self.ctx,
+                project_dir=self.project_dir,
+                profiles_dir=self.profiles_dir,
+                only_changed=True,
+            )
+        create_property_files.assert_not_called()
+
+    def test_update_earlier_macro(self):
+        """
+        Test that columns are collected one resource at a time, without
+        first attempting batches, when the project has the macro from an
+        earlier version of dbt-invoke
+
+        :return: None
+        """
+        self.macro_path.write_text(
+            "\n{# This macro is intended for use by dbt-invoke #}"
+            "\n{% macro _log_columns_list(sql=none, resource_name=none) %}"
+            "\n    {% if sql is none %}"
+            "\n        {% set sql = 'select * from ' ~ ref(resource_name) %}"
+            "\n    {% endif %}"
+            "\n    {% if execute %}"
+            "\n        {{ log(get_columns_in_query(sql), info=True) }}"
+            "\n    {% endif %}"
+            "\n{% endmacro %}\n"
+        )
+        with patch.object(
+            _utils,
+            'dbt_run_operation',
+            wraps=_utils.dbt_run_operation,
+        ) as dbt_run_operation:
+            properties.update(
+                self.ctx,
+                project_dir=self.project_dir,
+                profiles_dir=self.profiles_dir,
+            )
+        for call in dbt_run_operation.call_args_list:
+            self.assertNotIn('resource_names', call.kwargs)
+
+    def test_update_malformed_property_file(self):
+        """
+        Test that a malformed existing property file only fails its own
+        resource
+
+        :return: None
+        """
+        malformed_path = Path(
+            self.project_dir, 'models', 'marts', 'core', 'customers.yml'
+        )
+        malformed_path.write_text('version: 2\nmodels: [\n')
+        with patch('builtins.input', return_value='y'):
+            properties.update(
+                self.ctx,
+                project_dir=self.project_dir,
+                profiles_dir=self.profiles_dir,
+            )
+        self.assertEqual(
+            malformed_path.read_text(), 'version: 2\nmodels: [\n'
+        )
+        for file_location, exp_props in self.expected_properties.items():
+            full_file_path = Path(self.project_dir, file_location)
+            if full_file_path != malformed_path:
+                actual_props = _utils.parse_yaml(full_file_path)
+                self.assertEqual(exp_props, actual_props)
+        malformed_path.unlink()
+
+    def test_update_columns_cache(self):
+        """
+        Test that cached columns are reused when caching is enabled
+
+        :return: None
+        """
+        with tempfile.TemporaryDirectory() as cache_dir, patch.dict(
+            os.environ, {_utils.DBT_LS_CACHE_ENV_VAR: '1'}
+        ), patch.object(_utils, '_DBT_LS_CACHE_DIR', Path(cache_dir)):
+            with patch('builtins.input', return_value='y'):
+                properties.update(
+                    self.ctx,
+                    project_dir=self.project_dir,
+                    profiles_dir=self.profiles_dir,
+                )
+            self.assertTrue(any(Path(cache_dir, 'columns').iterdir()))
+            with patch.object(
+                _utils,
+                'dbt_run_operation',
+                wraps=_utils.dbt_run_operation,
+            ) as dbt_run_operation:
+                properties.update(
+                    self.ctx,
+                    project_dir=self.project_dir,
+                    profiles_dir=self.profiles_dir,
+                )
+        resource_names = set()
+        for call in dbt_run_operation.call_args_list:
+            resource_names.update(call.kwargs.get('resource_names', []))
+            resource_names.add(call.kwargs.get('resource_name'))
+        self.assertNotIn('customers', resource_names)
+
     def test_partial_migrate(self):
         """
         Test the partial migration of structure from one property file
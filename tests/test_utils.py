@@ -1,7 +1,12 @@
+import os
+import tempfile
+import time
 import unittest
 from pathlib import Path
 from unittest.mock import patch
 
+import invoke
+
 from dbt_invoke import properties
 from dbt_invoke.internal import _utils
 from test import TestDbtInvoke
@@ -52,6 +57,106 @@ class TestUtils(TestDbtInvoke):
                 ]
                 self.assertCountEqual(result_parts, expected_result_parts)
 
+    def test_dbt_ls_cache(self):
+        """
+        Test that "dbt ls" results are reused when caching is enabled
+
+        :return: None
+        """
+        dbt_ls_kwargs = {
+            'project_dir': self.project_dir,
+            'profiles_dir': self.profiles_dir,
+            'supported_resource_types': SUPPORTED_RESOURCE_TYPES,
+            'output': 'json',
+            'logger': self.logger,
+        }
+        with tempfile.TemporaryDirectory() as cache_dir, patch.dict(
+            os.environ, {_utils.DBT_LS_CACHE_ENV_VAR: '1'}
+        ), patch.object(_utils, '_DBT_LS_CACHE_DIR', Path(cache_dir)):
+            result_lines = _utils.dbt_ls(self.ctx, **dbt_ls_kwargs)
+            self.assertEqual(len(list(Path(cache_dir).iterdir())), 1)
+            with patch.object(
+                invoke.Context, 'run', side_effect=AssertionError
+            ), patch.object(_utils, '_invoke_dbt', side_effect=AssertionError):
+                cached_lines = _utils.dbt_ls(self.ctx, **dbt_ls_kwargs)
+            self.assertEqual(result_lines, cached_lines)
+
+    def test_prune_cache(self):
+        """
+        Test that cache files which have not been written for too long
+        are deleted when writing to the cache
+
+        :return: None
+        """
+        with tempfile.TemporaryDirectory() as cache_dir:
+            expired_path = Path(cache_dir, 'expired.json')
+            expired_path.write_text('[]')
+            expired_time = time.time() - _utils._CACHE_MAX_AGE_SECONDS - 60
+            os.utime(expired_path, (expired_time, expired_time))
+            cache_path = Path(cache_dir, 'current.json')
+            _utils._write_cache(cache_path, [], logger=self.logger)
+            self.assertTrue(cache_path.exists())
+            self.assertFalse(expired_path.exists())
+
+    def test_line_stream(self):
+        """
+        Test that output chunks are reassembled into complete lines
+
+        :return: None
+        """
+        lines = list()
+        line_stream = _utils._LineStream(lines.append)
+        for chunk in ['{"a": ', '1}\r\n{"b"', ': 2}\n\n', 'last']:
+            line_stream.write(chunk)
+        line_stream.close()
+        self.assertEqual(lines, ['{"a": 1}', '{"b": 2}', '', 'last'])
+
+    def test_get_cli_args(self):
+        """
+        Test that quoted CLI argument values are kept whole, without
+        their quotes, as they would be by a shell
+
+        :return: None
+        """
+        self.assertEqual(
+            _utils.get_cli_args(
+                select='customers,orders',
+                vars="'{my_var: 1}'",
+                target='"dev"',
+                profile=None,
+            ),
+            [
+                '--select',
+                'customers',
+                'orders',
+                '--vars',
+                '{my_var: 1}',
+                '--target',
+                'dev',
+            ],
+        )
+
+    def test_write_yaml_skip_unchanged(self):
+        """
+        Test that an unchanged yaml file is not rewritten
+
+        :return: None
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            location = Path(tmp_dir, 'unchanged.yml')
+            data = {'version': 2, 'models': [{'name': 'users'}]}
+            self.assertTrue(_utils.write_yaml(location, data))
+            self.assertFalse(
+                _utils.write_yaml(location, data, skip_unchanged=True)
+            )
+            data['models'][0]['description'] = ''
+            self.assertTrue(
+                _utils.write_yaml(location, data, skip_unchanged=True)
+            )
+            self.assertEqual(
+                _utils.parse_yaml(location, round_trip=False), data
+            )
+
 
 if __name__ == '__main__':
     unittest.main()